@@ -1,41 +1,59 @@
 import os
 import sys
 from pathlib import Path
-from dotenv import load_dotenv, find_dotenv
-
-# Try to find and load .env file
-env_file = find_dotenv()
-if env_file:
-    load_dotenv(env_file)
-else:
-    load_dotenv()
-
-# Debug: Check if API key is loaded
-api_key = os.getenv('BROWSER_USE_API_KEY')
-if not api_key:
-    print("❌ WARNING: BROWSER_USE_API_KEY not found!")
-    print(f"Current directory: {Path.cwd()}")
-    env_path = Path('.env')
-    if env_path.exists():
-        with open(env_path) as f:
-            for line in f:
-                if line.startswith('BROWSER_USE_API_KEY'):
-                    key = line.split('=', 1)[1].strip()
-                    os.environ['BROWSER_USE_API_KEY'] = key
-                    print(f"✅ Manually loaded API key from .env")
-                    break
+import streamlit as st
+from dotenv import load_dotenv, find_dotenv, dotenv_values
+
+@st.cache_resource
+def _load_env():
+    """Load .env once per server process and return the settings the app reads."""
+    # Try to find and load .env file
+    env_file = find_dotenv()
+    if env_file:
+        load_dotenv(env_file)
+    else:
+        load_dotenv()
+    
+    # Debug: Check if API key is loaded
+    api_key = os.getenv('BROWSER_USE_API_KEY')
+    if not api_key:
+        print("❌ WARNING: BROWSER_USE_API_KEY not found!")
+        print(f"Current directory: {Path.cwd()}")
+        env_path = Path('.env')
+        if env_path.exists():
+            # Load every key in one pass without overriding values already in the environment
+            vals = dotenv_values(env_path)
+            os.environ.update({k: v for k, v in vals.items() if k not in os.environ and v is not None})
+            api_key = os.getenv('BROWSER_USE_API_KEY')
+            if api_key:
+                print(f"✅ Manually loaded API key from .env")
+    
+    return {
+        'BROWSER_USE_API_KEY': api_key,
+        'GALILEO_PROJECT_NAME': os.getenv('GALILEO_PROJECT_NAME', 'chrome-tab-analyzer'),
+        'GALILEO_LOG_STREAM': os.getenv('GALILEO_LOG_STREAM', 'tab-analysis'),
+    }
+
+ENV = _load_env()
 
 # Set headless mode
 os.environ['HEADLESS'] = 'true'
 os.environ['PLAYWRIGHT_BROWSERS_PATH'] = '0'
 
 import asyncio
+import atexit
+import concurrent.futures
 import json
-import streamlit as st
+import queue
+import threading
+import time
+import types
 from datetime import datetime
-from playwright.async_api import async_playwright
+from playwright.async_api import async_playwright, Error as PlaywrightError
 from browser_use import Agent, ChatBrowserUse
 from collections import defaultdict
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from streamlit.runtime.scriptrunner import add_script_run_ctx
 
 # Galileo integration (Official SDK)
 try:
@@ -47,57 +65,330 @@ except ImportError:
     GALILEO_AVAILABLE = False
     print("⚠️  Galileo not installed")
 
+# Fast CDP liveness probes (optional)
+try:
+    import aiohttp
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    AIOHTTP_AVAILABLE = False
+    print("⚠️  aiohttp not installed, probing every port with Playwright")
+
+# Accurate token counts for Galileo (optional)
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+    print("⚠️  tiktoken not installed, estimating token counts")
+
+# Faster JSON export (optional)
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+    print("⚠️  orjson not installed, using json for exports")
+
+# ============================================================
+# EVENT LOOP
+# ============================================================
+
+_LOOP_THREAD_NAME = "hacksprint-event-loop"
+
+
+class _LoopThread(threading.Thread):
+    """Daemon thread running the shared event loop and owning the Playwright driver on it."""
+    
+    def __init__(self):
+        super().__init__(name=_LOOP_THREAD_NAME, daemon=True)
+        self.loop = asyncio.new_event_loop()
+        self.playwright = None
+    
+    def run(self):
+        self.loop.run_forever()
+    
+    def shutdown(self):
+        """Cancel work on this loop, stop its driver, then the loop; safe from any thread."""
+        if self.loop.is_closed() or not self.loop.is_running():
+            return
+        # Callers blocked in run_async get CancelledError instead of waiting forever
+        try:
+            asyncio.run_coroutine_threadsafe(_cancel_pending(), self.loop).result(timeout=5)
+        except Exception as e:
+            print(f"⚠️  Cancelling pending tasks failed: {e}")
+        if self.playwright is not None:
+            try:
+                asyncio.run_coroutine_threadsafe(self.playwright.stop(), self.loop).result(timeout=5)
+            except Exception as e:
+                print(f"⚠️  Playwright shutdown failed: {e}")
+            self.playwright = None
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+async def _cancel_pending():
+    """Cancel every other task on the running loop and wait for them to settle."""
+    current = asyncio.current_task()
+    tasks = [task for task in asyncio.all_tasks() if task is not current]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+@st.cache_resource
+def _loop_thread():
+    """Start the background loop thread, retiring any left behind by a cache clear."""
+    # The class is redefined on every rerun, so match old threads by name
+    for thread in threading.enumerate():
+        if thread.name == _LOOP_THREAD_NAME and hasattr(thread, 'shutdown'):
+            thread.shutdown()
+    
+    thread = _LoopThread()
+    thread.start()
+    atexit.register(thread.shutdown)
+    return thread
+
+
+def get_loop():
+    """Single event loop running in a background thread for the server's lifetime."""
+    return _loop_thread().loop
+
+
+def run_async(coro):
+    """Run a coroutine on the shared loop and block until it finishes.
+    
+    Raises concurrent.futures.CancelledError if the loop is retired mid-run.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result()
+
+
 # ============================================================
 # CHROME CONNECTION
 # ============================================================
 
-async def fetch_all_chrome_urls():
-    """Fetch all URLs from all tabs in Chrome across multiple instances."""
-    playwright = await async_playwright().start()
+# Internal browser pages that are never worth analyzing
+_SKIP_URLS = frozenset({'', 'about:blank'})
+_SKIP_PREFIXES = ('chrome://', 'chrome-extension://', 'edge://', 'devtools://')
+
+# Ports a launcher can record for running Chrome instances (a JSON list of ints)
+CHROME_PORTS_FILE = Path.home() / '.cache' / 'hacksprint' / 'chrome-ports.json'
+
+# Scanned when no ports file exists; cheap because liveness probes run in parallel
+SCAN_PORTS = range(9222, 9251)
+
+# Without the HTTP pre-probe every port costs a Playwright connect, so stay narrow
+DEFAULT_PORTS = range(9222, 9227)
+
+# Dead localhost ports refuse instantly, so this only bounds a live but busy debugger
+PROBE_TIMEOUT_S = 1.5
+
+# Upper bound on a single page.title() round-trip so one hung tab can't stall a fetch
+TITLE_TIMEOUT_S = 0.5
+
+
+async def get_playwright():
+    """Return the shared Playwright driver, starting it on first use.
+    
+    Must run on the shared loop; the driver lives and dies with that loop's thread.
+    """
+    thread = threading.current_thread()
+    if thread.name != _LOOP_THREAD_NAME:
+        raise RuntimeError("get_playwright() must be awaited on the shared event loop")
+    
+    if thread.playwright is None:
+        thread.playwright = await async_playwright().start()
+    
+    return thread.playwright
+
+
+def _ports_to_check():
+    """Ports recorded at Chrome launch, else a range wide enough for several instances."""
+    try:
+        ports = json.loads(CHROME_PORTS_FILE.read_text())
+        # bool is an int subclass, but true/false in the file is not a port
+        if isinstance(ports, list) and ports and all(
+            isinstance(port, int) and not isinstance(port, bool) and 1 <= port <= 65535
+            for port in ports
+        ):
+            return sorted(set(ports))
+        print(f"⚠️  Ignoring {CHROME_PORTS_FILE}: expected a non-empty list of ports in 1-65535")
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        print(f"⚠️  Ignoring unreadable {CHROME_PORTS_FILE}: {e}")
+    
+    return list(SCAN_PORTS if AIOHTTP_AVAILABLE else DEFAULT_PORTS)
+
+
+async def _alive(session, port, issues):
+    """Cheap check that something answers the CDP /json/version endpoint on a port."""
+    try:
+        async with session.get(
+            f"http://127.0.0.1:{port}/json/version",
+            timeout=aiohttp.ClientTimeout(total=PROBE_TIMEOUT_S)
+        ) as r:
+            return r.status == 200
+    except asyncio.TimeoutError:
+        # Something is listening but too slow to answer; tell the user rather than hide it
+        issues.append(f"Chrome on port {port} did not answer within {PROBE_TIMEOUT_S}s, skipping it")
+        return False
+    except (aiohttp.ClientError, OSError):
+        return False
+    except Exception as e:
+        # A bad port must not take down the whole fetch via gather
+        print(f"⚠️  Liveness probe failed on port {port}: {e}")
+        return False
+
+
+async def _alive_ports(ports, issues):
+    """Filter ports down to those with a live CDP endpoint."""
+    if not AIOHTTP_AVAILABLE:
+        return ports
+    
+    async with aiohttp.ClientSession() as session:
+        alive = await asyncio.gather(*[_alive(session, port, issues) for port in ports])
+    return [port for port, ok in zip(ports, alive) if ok]
+
+
+async def _probe_port(pw, port, issues):
+    """Collect tab info from the Chrome instance on a single CDP port."""
+    try:
+        print(f"🔍 Checking port {port}...")
+        browser = await pw.chromium.connect_over_cdp(f"http://127.0.0.1:{port}")
+    except (PlaywrightError, OSError) as e:
+        # Without the HTTP pre-probe, dead ports are expected and not worth reporting
+        if AIOHTTP_AVAILABLE:
+            issues.append(f"Could not connect to Chrome on port {port}: {e}")
+        return None
+    
+    print(f"✅ Connected to Chrome on port {port}")
+    print(f"🔍 Found {len(browser.contexts)} browser context(s)")
+    
+    try:
+        try:
+            tabs = await _tabs_from_targets(browser, port)
+        except PlaywrightError as e:
+            print(f"⚠️  Target.getTargets failed on port {port}, falling back to per-page titles: {e}")
+            tabs = await _tabs_from_pages(browser, port, issues)
+    finally:
+        await browser.close()
+    
+    return port, tabs
+
+
+async def _tabs_from_targets(browser, port):
+    """Read every page's url and title with a single Target.getTargets call."""
+    session = await browser.new_browser_cdp_session()
+    try:
+        targets = await session.send("Target.getTargets")
+    finally:
+        await session.detach()
+    
+    tabs = []
+    windows = {}
+    tab_counts = defaultdict(int)
     
-    ports_to_check = [9222, 9223, 9224, 9225, 9226]
+    for target in targets.get('targetInfos', []):
+        if target.get('type') != 'page':
+            continue
+        
+        # Number windows/tabs in the order Chrome reports them, as the page path does
+        window = windows.setdefault(target.get('browserContextId'), len(windows) + 1)
+        tab_counts[window] += 1
+        
+        url = target.get('url', '')
+        if url in _SKIP_URLS or url.startswith(_SKIP_PREFIXES):
+            continue
+        
+        tab_info = {
+            'port': port,
+            'window': window,
+            'tab': tab_counts[window],
+            'url': url,
+            'title': target.get('title', '')
+        }
+        
+        tabs.append(tab_info)
+    
+    return tabs
+
+
+async def _tabs_from_pages(browser, port, issues):
+    """Collect tab info by querying each page's title individually."""
+    tabs = []
+    skipped = 0
+    
+    for ctx_idx, context in enumerate(browser.contexts):
+        pages = context.pages
+        print(f"🪟 Context {ctx_idx + 1}: {len(pages)} page(s)")
+        
+        # Each title is an independent CDP round-trip, so fetch them together
+        titles = await asyncio.gather(
+            *[asyncio.wait_for(page.title(), timeout=TITLE_TIMEOUT_S) for page in pages],
+            return_exceptions=True
+        )
+        
+        for page_idx, (page, title) in enumerate(zip(pages, titles)):
+            if isinstance(title, (PlaywrightError, asyncio.TimeoutError)):
+                skipped += 1
+                continue
+            if isinstance(title, BaseException):
+                raise title
+            
+            url = page.url
+            if url in _SKIP_URLS or url.startswith(_SKIP_PREFIXES):
+                continue
+            
+            tab_info = {
+                'port': port,
+                'window': ctx_idx + 1,
+                'tab': page_idx + 1,
+                'url': url,
+                'title': title
+            }
+            
+            tabs.append(tab_info)
+    
+    if skipped:
+        issues.append(f"Skipped {skipped} unresponsive tab(s) on port {port}")
+    
+    return tabs
+
+
+async def fetch_all_chrome_urls(issues=None):
+    """Fetch all URLs from all tabs in Chrome across multiple instances.
+    
+    Returns the flat tab list plus the same tabs grouped by port, in port order.
+    Problems worth showing the user are appended to issues, if given.
+    """
+    if issues is None:
+        issues = []
+    
+    playwright = await get_playwright()
+    
+    ports_to_check = _ports_to_check()
     all_urls = []
+    tabs_by_port = {}
     connected_ports = []
     
     try:
-        for port in ports_to_check:
-            try:
-                print(f"🔍 Checking port {port}...")
-                browser = await playwright.chromium.connect_over_cdp(f"http://127.0.0.1:{port}")
-                
-                print(f"✅ Connected to Chrome on port {port}")
-                print(f"🔍 Found {len(browser.contexts)} browser context(s)")
-                connected_ports.append(port)
-                
-                for ctx_idx, context in enumerate(browser.contexts):
-                    pages = context.pages
-                    print(f"🪟 Context {ctx_idx + 1}: {len(pages)} page(s)")
-                    
-                    for page_idx, page in enumerate(pages):
-                        try:
-                            url = page.url
-                            title = await page.title()
-                            
-                            if url in ['about:blank', 'chrome://newtab/', ''] or url.startswith('chrome://'):
-                                continue
-                            
-                            tab_info = {
-                                'port': port,
-                                'window': ctx_idx + 1,
-                                'tab': page_idx + 1,
-                                'url': url,
-                                'title': title
-                            }
-                            
-                            all_urls.append(tab_info)
-                            
-                        except Exception as e:
-                            continue
-                
-                await browser.close()
-                
-            except Exception as e:
-                continue
+        # Only pay for a Playwright connect on ports that answered the HTTP probe
+        alive_ports = await _alive_ports(ports_to_check, issues)
+        
+        results = await asyncio.gather(
+            *[_probe_port(playwright, port, issues) for port in alive_ports],
+            return_exceptions=True
+        )
+        
+        for port, result in zip(alive_ports, results):
+            if isinstance(result, BaseException):
+                issues.append(f"Failed to read tabs on port {port}: {result}")
+        
+        for result in sorted(r for r in results if isinstance(r, tuple)):
+            port, tabs = result
+            connected_ports.append(port)
+            all_urls.extend(tabs)
+            if tabs:
+                tabs_by_port[port] = tabs
         
         if connected_ports:
             print(f"\n{'='*70}")
@@ -107,46 +398,144 @@ async def fetch_all_chrome_urls():
         else:
             print(f"\n❌ No Chrome instances found")
         
-        return all_urls
+        return all_urls, tabs_by_port
         
     except Exception as e:
         print(f"\n❌ Error: {e}")
-        return []
-        
-    finally:
-        await playwright.stop()
+        issues.append(f"Error fetching tabs: {e}")
+        return [], {}
 
 
 # ============================================================
 # AI ANALYSIS
 # ============================================================
 
-async def analyze_urls(tabs, custom_task):
-    """Analyze tabs using Browser Use with Galileo tracking."""
-    
-    if not tabs:
+MAX_TITLE_CHARS = 120
+
+# Bound runaway agent runs; a tab analysis normally finishes in a few steps
+MAX_AGENT_STEPS = 25
+
+
+@st.cache_resource
+def get_llm():
+    """Shared Browser Use LLM client, reused across analyses."""
+    return ChatBrowserUse()
+
+
+def normalize_url(url):
+    """Lowercase the host and drop tracking params so duplicate tabs compare equal."""
+    parts = urlsplit(url)
+    query = [
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not k.startswith('utm_') and k != 'fbclid'
+    ]
+    return urlunsplit((parts.scheme, parts.netloc.lower(), parts.path, urlencode(query), parts.fragment))
+
+
+def dedupe_tabs(tabs):
+    """Collapse tabs that share a normalized URL, returning (tab, count) pairs."""
+    seen = {}
+    counts = defaultdict(int)
+    for tab in tabs:
+        key = normalize_url(tab['url'])
+        seen.setdefault(key, tab)
+        counts[key] += 1
+    return [(tab, counts[key]) for key, tab in seen.items()]
+
+
+def _step_summary(model_output, step_number):
+    """One markdown line describing what the agent is about to do."""
+    # Older Browser Use releases nest the agent's brain under current_state
+    brain = getattr(model_output, 'current_state', model_output)
+    goal = getattr(brain, 'next_goal', None) or "Thinking..."
+    return f"**Step {step_number}:** {goal}\n\n"
+
+
+@st.cache_resource
+def _pending_flushes():
+    """Galileo uploads still in flight, drained when the server exits."""
+    pending = set()
+    atexit.register(_drain_flushes, pending)
+    return pending
+
+
+def _drain_flushes(pending):
+    """Wait briefly for outstanding Galileo uploads so traces aren't lost on shutdown."""
+    tasks = list(pending)
+    if not tasks:
+        return
+    loop = tasks[0].get_loop()
+    if loop.is_closed() or not loop.is_running():
+        return
+    try:
+        asyncio.run_coroutine_threadsafe(asyncio.wait(tasks), loop).result(timeout=10)
+    except Exception as e:
+        print(f"⚠️  Galileo flush on shutdown failed: {e}")
+
+
+@st.cache_resource
+def _galileo_lock():
+    """Serializes use of the shared Galileo logger with its background flushes."""
+    return asyncio.Lock()
+
+
+async def _flush_galileo(logger, lock):
+    """Upload buffered Galileo spans in a worker thread, then release the logger lock."""
+    try:
+        await asyncio.to_thread(logger.flush)
+        print("✅ Logged to Galileo")
+    except Exception as e:
+        print(f"⚠️  Galileo flush failed: {e}")
+    finally:
+        lock.release()
+
+
+@st.cache_resource
+def _encoding():
+    """BPE encoding used to count prompt and response tokens, or None if it can't load."""
+    # The first load downloads the BPE file, which fails or hangs on offline hosts;
+    # None is cached too, so that download is only attempted once
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        print(f"⚠️  tiktoken encoding unavailable, estimating token counts: {e}")
         return None
+
+
+def count_tokens(text):
+    """Token count for text, falling back to a chars/4 estimate without tiktoken.
     
-    # Initialize Galileo if available
-    logger = None
-    galileo_session_started = False
+    May block on a first-time download, so call it off the event loop.
+    """
+    encoding = _encoding() if TIKTOKEN_AVAILABLE else None
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return len(text) // 4
+
+
+def _format_tab(i, tab, count, trim_titles):
+    """One numbered prompt line for a (deduplicated) tab."""
+    title = tab['title'][:MAX_TITLE_CHARS] if trim_titles else tab['title']
+    line = f"{i}. {title} - {tab['url']}"
+    if count > 1:
+        line += f" (open in {count} tabs)"
+    return line
+
+
+async def analyze_urls(tabs, custom_task, trim_titles=True, on_step=None):
+    """Analyze tabs using Browser Use with Galileo tracking.
     
-    if GALILEO_AVAILABLE:
-        try:
-            project_name = os.getenv('GALILEO_PROJECT_NAME', 'chrome-tab-analyzer')
-            log_stream = os.getenv('GALILEO_LOG_STREAM', 'tab-analysis')
-            
-            galileo_context.init(project=project_name, log_stream=log_stream)
-            logger = galileo_context.get_logger_instance()
-            logger.start_session()
-            galileo_session_started = True
-            print(f"✅ Galileo session started for project: {project_name}")
-        except Exception as e:
-            print(f"⚠️  Galileo initialization failed: {e}")
-            logger = None
+    If on_step is given it is called with a short progress line after every agent step.
+    """
+    
+    if not tabs:
+        return None
     
     # Format URLs
-    urls_text = "\n".join([f"{i+1}. {tab['title']} - {tab['url']}" for i, tab in enumerate(tabs)])
+    urls_text = "\n".join(
+        _format_tab(i, tab, count, trim_titles)
+        for i, (tab, count) in enumerate(dedupe_tabs(tabs), 1)
+    )
     
     # Create task
     task = f"""
@@ -157,43 +546,83 @@ async def analyze_urls(tabs, custom_task):
     {custom_task}
     """
     
-    # Start Galileo trace
-    if logger and galileo_session_started:
-        try:
-            logger.start_trace(name="Browser Tab Analysis", input=task)
-            start_time_ns = datetime.now().timestamp() * 1_000_000_000
-        except Exception as e:
-            print(f"⚠️  Galileo trace failed: {e}")
+    # Initialize Galileo if available
+    logger = None
+    galileo_session_started = False
+    start_time_ns = None
+    
+    if GALILEO_AVAILABLE:
+        # The logger is shared, and an in-flight flush reads and then resets its buffers,
+        # so don't start a new session or trace until the previous flush has finished
+        async with _galileo_lock():
+            try:
+                project_name = ENV['GALILEO_PROJECT_NAME']
+                log_stream = ENV['GALILEO_LOG_STREAM']
+                
+                galileo_context.init(project=project_name, log_stream=log_stream)
+                logger = galileo_context.get_logger_instance()
+                logger.start_session()
+                galileo_session_started = True
+                print(f"✅ Galileo session started for project: {project_name}")
+            except Exception as e:
+                print(f"⚠️  Galileo initialization failed: {e}")
+                logger = None
+            
+            # Start Galileo trace
+            if logger and galileo_session_started:
+                try:
+                    logger.start_trace(name="Browser Tab Analysis", input=task)
+                    start_time_ns = time.perf_counter_ns()
+                except Exception as e:
+                    print(f"⚠️  Galileo trace failed: {e}")
     
     # Run Browser Use analysis
-    llm = ChatBrowserUse()
-    agent = Agent(task=task, llm=llm)
+    llm = get_llm()
+    step_callback = None
+    if on_step:
+        def step_callback(browser_state, model_output, step_number):
+            on_step(_step_summary(model_output, step_number))
+    
+    # The tab list is already in the prompt, so screenshots add cost without helping
+    agent = Agent(task=task, llm=llm, use_vision=False, register_new_step_callback=step_callback)
     
-    result = await agent.run()
+    result = await agent.run(max_steps=MAX_AGENT_STEPS)
     
     # Get analysis
     analysis = result.final_result()
     clean_analysis = analysis.replace('\\n', '\n') if analysis else "Analysis failed"
     
-    # Log to Galileo
-    if logger and galileo_session_started:
+    # Log to Galileo (only if the trace actually started)
+    if logger and galileo_session_started and start_time_ns is not None:
+        duration_ns = time.perf_counter_ns() - start_time_ns
+        # Counted in a worker thread before locking, so a slow encoder load stalls neither
+        in_tok, out_tok = await asyncio.to_thread(
+            lambda: (count_tokens(task), count_tokens(clean_analysis))
+        )
+        
+        # Held until the background flush completes; _flush_galileo releases it
+        galileo_lock = _galileo_lock()
+        await galileo_lock.acquire()
+        flush_scheduled = False
         try:
-            duration_ns = (datetime.now().timestamp() * 1_000_000_000) - start_time_ns
-            
             logger.add_llm_span(
                 input=task,
                 output=clean_analysis,
                 model="browser-use-agent",
-                num_input_tokens=len(task) // 4,
-                num_output_tokens=len(clean_analysis) // 4,
-                total_tokens=(len(task) + len(clean_analysis)) // 4,
-                duration_ns=int(duration_ns),
+                num_input_tokens=in_tok,
+                num_output_tokens=out_tok,
+                total_tokens=in_tok + out_tok,
+                duration_ns=duration_ns,
             )
             
             logger.conclude(output=clean_analysis)
-            logger.flush()
             
-            print("✅ Logged to Galileo")
+            # Upload in the background so the result isn't held up by the network round-trip
+            task_ref = asyncio.create_task(_flush_galileo(logger, galileo_lock))
+            flush_scheduled = True
+            pending = _pending_flushes()
+            pending.add(task_ref)
+            task_ref.add_done_callback(pending.discard)
             
             config = GalileoPythonConfig.get()
             project_url = f"{config.console_url}project/{logger.project_id}"
@@ -203,14 +632,110 @@ async def analyze_urls(tabs, custom_task):
             
         except Exception as e:
             print(f"⚠️  Galileo logging failed: {e}")
+        finally:
+            if not flush_scheduled:
+                galileo_lock.release()
     
-    return clean_analysis
+    # Galileo still records the failure above, but callers get None so it isn't cached
+    return clean_analysis if analysis else None
+
+
+class AnalysisFailed(Exception):
+    """Raised from the cached analysis so st.cache_data doesn't store a failed run."""
+
+
+@st.cache_data(show_spinner=False, ttl=3600)
+def analyze_urls_cached(tab_key, custom_task, trim_titles=True, _on_step=None):
+    """Run analyze_urls once per (tabs, task) pair and reuse the result for an hour."""
+    tabs = [{'url': url, 'title': title} for url, title in tab_key]
+    analysis = run_async(analyze_urls(tabs, custom_task, trim_titles, _on_step))
+    if not analysis:
+        raise AnalysisFailed()
+    return analysis
+
+
+def _tab_key(tabs):
+    """Canonical, hashable view of the tab fields the analysis actually reads."""
+    return tuple((tab['url'], tab['title']) for tab in tabs)
+
+
+def stream_analysis(tabs, custom_task, trim_titles, force_refresh, outcome):
+    """Yield agent progress lines while the analysis runs, storing the result in outcome."""
+    steps = queue.Queue()
+    
+    def run():
+        tab_key = _tab_key(tabs)
+        try:
+            # Drop just this entry so the fresh result replaces it in the cache
+            if force_refresh:
+                analyze_urls_cached.clear(tab_key, custom_task, trim_titles)
+            outcome['analysis'] = analyze_urls_cached(
+                tab_key, custom_task, trim_titles, _on_step=steps.put
+            )
+        except AnalysisFailed:
+            outcome['analysis'] = None
+        except concurrent.futures.CancelledError:
+            outcome['interrupted'] = True
+        except Exception as e:
+            outcome['error'] = e
+        finally:
+            steps.put(None)
+    
+    # The analysis blocks, so run it off the script thread and drain progress here
+    worker = threading.Thread(target=run, daemon=True)
+    add_script_run_ctx(worker)
+    worker.start()
+    
+    while (step := steps.get()) is not None:
+        yield step
+    
+    worker.join()
+    if 'error' in outcome:
+        raise outcome['error']
 
 
 # ============================================================
 # STREAMLIT APP
 # ============================================================
 
+_SIDEBAR_MD = """
+**Step 1:** Launch Chrome with remote debugging:
+
+**macOS:**
+```bash
+/Applications/Google\\ Chrome.app/Contents/MacOS/Google\\ Chrome --remote-debugging-port=9222 --user-data-dir="/tmp/chrome-debug" &
+```
+
+Running several instances? Give each its own port and profile. The app scans
+ports 9222-9250 (9222-9226 without `aiohttp`). To probe only specific ports, list
+them in `~/.cache/hacksprint/chrome-ports.json`, e.g. `[9222, 9230]`.
+
+**Step 2:** Open your tabs in Chrome
+
+**Step 3:** Click "Fetch Tabs"
+
+**Step 4:** Analyze!
+"""
+
+_QUICK_TASKS = types.MappingProxyType({
+    "Analyze & Categorize": "Please analyze these tabs and tell me:\n1. What categories/topics do they fall into?\n2. Which domains appear most?\n3. What am I probably working on or researching?\n4. Any duplicate or similar tabs I should close?",
+    "Find Duplicates": "Find any duplicate or very similar tabs that I should close. List them clearly.",
+    "Create Reading List": "Organize these tabs into a prioritized reading list. Group by topic and suggest an order.",
+    "Summarize Research": "Summarize what I'm researching based on these tabs. What are the main themes and connections?",
+    "Time Management": "Which of these tabs are time-wasters vs. productive? Help me focus.",
+    "Custom": ""
+})
+
+_QUICK_TASK_KEYS = tuple(_QUICK_TASKS)
+
+
+def _dumps_export(export_data):
+    """Pretty-printed JSON for the export download."""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(export_data, option=orjson.OPT_INDENT_2).decode()
+    return json.dumps(export_data, indent=2)
+
+
 def main():
     st.set_page_config(
         page_title="Chrome Tab Analyzer",
@@ -224,30 +749,23 @@ def main():
     # Sidebar
     with st.sidebar:
         st.header("📋 Instructions")
-        st.markdown("""
-        **Step 1:** Launch Chrome with remote debugging:
-        
-        **macOS:**
-        ```bash
-        /Applications/Google\\ Chrome.app/Contents/MacOS/Google\\ Chrome --remote-debugging-port=9222 --user-data-dir="/tmp/chrome-debug" &
-        ```
-        
-        **Step 2:** Open your tabs in Chrome
-        
-        **Step 3:** Click "Fetch Tabs"
-        
-        **Step 4:** Analyze!
-        """)
+        st.markdown(_SIDEBAR_MD)
         
         st.markdown("---")
         
         # Galileo status
         if GALILEO_AVAILABLE:
             st.success("✅ Galileo SDK enabled")
-            st.caption(f"Project: {os.getenv('GALILEO_PROJECT_NAME', 'chrome-tab-analyzer')}")
+            st.caption(f"Project: {ENV['GALILEO_PROJECT_NAME']}")
         else:
             st.info("💡 Galileo not configured")
         
+        st.markdown("---")
+        force_refresh = st.checkbox(
+            "Force refresh",
+            help="Re-run the analysis even if these tabs and task were analyzed recently"
+        )
+        
         st.markdown("---")
         st.markdown("**💡 Example Tasks:**")
         st.markdown("""
@@ -263,10 +781,20 @@ def main():
     with col1:
         if st.button("🔄 Fetch Tabs", use_container_width=True, type="primary"):
             with st.spinner("Fetching tabs..."):
-                tabs = asyncio.run(fetch_all_chrome_urls())
+                # Filled on the loop thread; only read after the fetch has completed
+                issues = []
+                try:
+                    tabs, tabs_by_port = run_async(fetch_all_chrome_urls(issues))
+                except concurrent.futures.CancelledError:
+                    issues.append("Fetch was interrupted because the app reloaded. Please try again.")
+                    tabs, tabs_by_port = [], {}
+                for issue in issues:
+                    st.warning(f"⚠️ {issue}")
                 
                 if tabs:
                     st.session_state['tabs'] = tabs
+                    st.session_state['tabs_by_port'] = tabs_by_port
+                    st.session_state.pop('export_json', None)
                     st.session_state['timestamp'] = datetime.now().isoformat()
                     st.success(f"✅ Found {len(tabs)} tabs!")
                 else:
@@ -284,12 +812,7 @@ def main():
         
         # Tabs preview
         with st.expander(f"👀 View All {len(tabs)} Tabs", expanded=False):
-            tabs_by_port = defaultdict(list)
-            for tab in tabs:
-                tabs_by_port[tab.get('port', 'Unknown')].append(tab)
-            
-            for port in sorted(tabs_by_port.keys()):
-                port_tabs = tabs_by_port[port]
+            for port, port_tabs in st.session_state['tabs_by_port'].items():
                 st.markdown(f"### 🌐 Chrome Instance (Port {port}) - {len(port_tabs)} tabs")
                 
                 for i, tab in enumerate(port_tabs):
@@ -303,18 +826,9 @@ def main():
         # Task input
         st.subheader("🎯 What would you like me to do with these tabs?")
         
-        quick_tasks = {
-            "Analyze & Categorize": "Please analyze these tabs and tell me:\n1. What categories/topics do they fall into?\n2. Which domains appear most?\n3. What am I probably working on or researching?\n4. Any duplicate or similar tabs I should close?",
-            "Find Duplicates": "Find any duplicate or very similar tabs that I should close. List them clearly.",
-            "Create Reading List": "Organize these tabs into a prioritized reading list. Group by topic and suggest an order.",
-            "Summarize Research": "Summarize what I'm researching based on these tabs. What are the main themes and connections?",
-            "Time Management": "Which of these tabs are time-wasters vs. productive? Help me focus.",
-            "Custom": ""
-        }
-        
         task_type = st.radio(
             "Choose a task type:",
-            options=list(quick_tasks.keys()),
+            options=_QUICK_TASK_KEYS,
             horizontal=True
         )
         
@@ -327,7 +841,7 @@ def main():
         else:
             custom_task = st.text_area(
                 "Task (you can edit this):",
-                value=quick_tasks[task_type],
+                value=_QUICK_TASKS[task_type],
                 height=150
             )
         
@@ -337,11 +851,24 @@ def main():
                 st.error("❌ Please enter a task!")
             else:
                 with st.spinner("🧠 AI is analyzing your tabs..."):
-                    analysis = asyncio.run(analyze_urls(tabs, custom_task))
+                    # Duplicate detection may hinge on small title differences, so keep them whole
+                    trim_titles = task_type != "Find Duplicates"
+                    outcome = {}
+                    placeholder = st.empty()
+                    with placeholder.container():
+                        st.write_stream(
+                            stream_analysis(tabs, custom_task.strip(), trim_titles, force_refresh, outcome)
+                        )
+                    placeholder.empty()
+                    analysis = outcome.get('analysis')
                     
                     if analysis:
                         st.session_state['analysis'] = analysis
+                        st.session_state['analysis_task'] = custom_task
+                        st.session_state.pop('export_json', None)
                         st.success("✅ Analysis complete!")
+                    elif outcome.get('interrupted'):
+                        st.error("❌ Analysis was interrupted because the app reloaded. Please try again.")
                     else:
                         st.error("❌ Analysis failed.")
         
@@ -361,19 +888,24 @@ def main():
                     mime="text/plain"
                 )
             with col2:
-                export_data = {
-                    'timestamp': st.session_state.get('timestamp'),
-                    'total_tabs': len(tabs),
-                    'task': custom_task,
-                    'analysis': st.session_state['analysis'],
-                    'tabs': tabs
-                }
-                st.download_button(
-                    "📋 Download as JSON",
-                    json.dumps(export_data, indent=2),
-                    file_name=f"tab_analysis_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
-                    mime="application/json"
-                )
+                # Only serialize once the user asks for it, and then only once per analysis
+                if 'export_json' not in st.session_state and st.button("📋 Prepare JSON export"):
+                    export_data = {
+                        'timestamp': st.session_state.get('timestamp'),
+                        'total_tabs': len(tabs),
+                        'task': st.session_state.get('analysis_task', custom_task),
+                        'analysis': st.session_state['analysis'],
+                        'tabs': tabs
+                    }
+                    st.session_state['export_json'] = _dumps_export(export_data)
+                
+                if 'export_json' in st.session_state:
+                    st.download_button(
+                        "📋 Download as JSON",
+                        st.session_state['export_json'],
+                        file_name=f"tab_analysis_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+                        mime="application/json"
+                    )
     
     else:
         st.info("👆 Click 'Fetch Tabs' to get started!")